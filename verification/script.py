@@ -3,23 +3,117 @@
 # Inspired by: https://github.com/leonardobarilani/warehouse-model-checking/blob/main/src/simulation/sim.py
 
 import argparse
-import csv
+import atexit
+from contextlib import nullcontext, suppress
+from functools import partial
+import hashlib
+import io
 from itertools import product
 import json
 import os
-from multiprocessing import Pool
+from multiprocessing import get_context
+from multiprocessing.pool import Pool
+from multiprocessing.synchronize import Event
+from queue import Queue
 import re
 import shutil
 import signal
 import subprocess
+import sys
+import tempfile
 from time import time
 import numpy
 from tqdm import tqdm
-import xml.etree.ElementTree as ET
+try:
+    import lxml.etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FORMULA_PREFIXES = ('A', 'Pr', 'simulate')
+
+CONTROL_KEYS = ('monotone', 'stop_on_first_sat')
+
+MONOTONE_DIRECTIONS = ('increasing', 'decreasing')
+
+SHARED_MEMORY = '/dev/shm'
+
+CACHE_DIRECTORY = '.verifyta_cache'
+
+# Workers only generate files and call verifyta, so forking them is safe and skips re-importing this script
+CONTEXT = get_context('spawn' if sys.platform == 'win32' else 'fork')
+
+MAX_CHUNKSIZE = 16
+
+ARRAY_FORMAT = '{{{}}}'
+SHORT_ARRAY_FORMAT = '[{}]'
+
+INTERVAL_REGEX = re.compile(r'\[([\d.e-]+),([\d.e-]+)\]\s+\(([\d]+)\% CI\)')
+VALUES_REGEX = re.compile(r'Values in \[(\d+),(\d+)\] mean=([\d.e-]+) steps=1: (.+)')
+SERIES_REGEX = re.compile(r'\(([\d.]+),(\d+)\)')
+SERIES_LINE_REGEX = re.compile(r'([^\r\n]*)\r\n(\[\d+\]:[^\r\n]*)')
+
+TIMEOUT_RESULT = ' -- Timeout, verification interrupted.'
+
+INFERRED_RESULTS = {True: ' -- Formula is satisfied (inferred).', False: ' -- Formula is NOT satisfied (inferred).'}
+
+worker = {}
+
+SYSTEM_TEMPLATE = '''    <system>
+const int SPEED = {speed};
+const int[1, 12] DISKS = {disks};
+const SlotId POS_OUT_SENSORS[OUT_SENSORS] = {out_sensors};
+const int STATIONS_ELABORATION_TIME[STATIONS] = {stations_processing};
+
+initializer = Initializer(DISKS);
+motor = Motor(SPEED);
+conveyorBelt = ConveyorBelt();
+station(const StationId id) = Station(id, POS_STATIONS[id], STATIONS_ELABORATION_TIME[id], POS_IN_SENSORS_IN_ORDER[id], OUT_SENSORS_ID_IN_ORDER[id]);
+inSensor(const InSensorId id) = InSensor(id, IN_SENSORS_STATION[id]);
+outSensor(const OutSensorId id) = OutSensor(id, POS_OUT_SENSORS[id]);
+flowController = {flow_controller};
+system initializer, motor, conveyorBelt, station, inSensor, outSensor, flowController;
+    </system>
+'''
+
+STOCHASTIC_SYSTEM_TEMPLATE = '''    <system>
+const int SPEED = {speed};
+const int[1, 12] DISKS = {disks};
+const SlotId POS_OUT_SENSORS[OUT_SENSORS] = {out_sensors};
+const int STATIONS_ELABORATION_TIME[STATIONS] = {stations_processing};
+const double STD_DEV_STATIONS[STATIONS] = {station_std_deviation};
+const int IN_SENSORS_ERR[IN_SENSORS] = {in_sensor_err};
+const int IN_SENSORS_RIGHT[IN_SENSORS] = {in_sensor_right};
+const int OUT_SENSORS_ERR[OUT_SENSORS] = {out_sensor_err};
+const int OUT_SENSORS_RIGHT[OUT_SENSORS] = {out_sensor_right};
+
+initializer = Initializer(DISKS);
+motor = Motor(SPEED);
+conveyorBelt = ConveyorBelt();
+station(const StationId id) = Station(id, POS_STATIONS[id], STATIONS_ELABORATION_TIME[id], POS_IN_SENSORS_IN_ORDER[id], OUT_SENSORS_ID_IN_ORDER[id], STD_DEV_STATIONS[id]);
+inSensor(const InSensorId id) = InSensor(id, IN_SENSORS_STATION[id], IN_SENSORS_RIGHT[id], IN_SENSORS_ERR[id]);
+outSensor(const OutSensorId id) = OutSensor(id, POS_OUT_SENSORS[id], OUT_SENSORS_RIGHT[id], OUT_SENSORS_ERR[id]);
+flowController = {flow_controller};
+system initializer, motor, conveyorBelt, station, inSensor, outSensor, flowController;
+    </system>
+'''
 
 def handle_sigint(*_):
     exit(0)
 
+def dumps(value) -> str:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode()
+    return json.dumps(value, sort_keys=True)
+
+def get_output_directory() -> str:
+    if os.path.isdir(SHARED_MEMORY) and os.access(SHARED_MEMORY, os.W_OK):
+        return tempfile.mkdtemp(prefix='verification-', dir=SHARED_MEMORY)
+    return tempfile.mkdtemp(prefix='verification-')
+
 def get_args():
     ap = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     ap.add_argument('-v', '--verifyta', type=str, metavar='VERIFYTA_PATH', default='/Applications/UPPAAL.app/Contents/Resources/uppaal/bin/verifyta', help='path to verifyta executable')
@@ -27,63 +121,53 @@ def get_args():
     ap.add_argument('-nq', '--no-queries', default=False, action=argparse.BooleanOptionalAction)
     ap.add_argument('-np', '--no-probabilities', default=False, action=argparse.BooleanOptionalAction)
     ap.add_argument('-ns', '--no-simulations', default=False, action=argparse.BooleanOptionalAction)
+    ap.add_argument('-nc', '--no-cache', default=False, action=argparse.BooleanOptionalAction, help='do not reuse the verifyta output of previously verified queries')
+    ap.add_argument('-t', '--task-timeout', type=int, metavar='SECONDS', default=None, help='maximum duration of a single verifyta run, unlimited if not set')
     ap.add_argument('--short', default=False, action=argparse.BooleanOptionalAction)
     ap.add_argument('config_fname', type=str, metavar='config.json', help='configuration to use for the simulation')
     ap.add_argument('project_fname', type=str, metavar='project.xml', help='project template to use for simulation')
     return ap.parse_args()
 
-def get_project(file_name: str) -> list[str]:
-    project = []
-    stochastic = False
+def get_project(file_name: str) -> tuple[str, bool]:
     with open(file_name, 'r') as file:
-        for line in file.readlines():
-            if 'stochastic' in line:
-                stochastic = True
-            project.append(line[:-1])
-    return project, stochastic
+        content = file.read()
+    return content, 'stochastic' in content
+
+def split_project(content: str) -> tuple[str, str]:
+    start = content.rfind('\n', 0, content.index('<system>')) + 1
+    end = content.find('\n', content.index('</system>')) + 1 or len(content)
+    return content[:start], content[end:]
 
 def get_config(file_name: str) -> dict:
     with open(file_name, 'r') as file:
         return json.loads(file.read())
 
-def parse_project(content: str, start: str) -> list[str]:
-    tree = ET.fromstring(content)
-    result = []
-    for formula in tree.iter('formula'):
-        if not formula.text == None and formula.text.startswith(start):
-            result.append(formula.text)
-    return [item.replace('\n', ' ').replace('\t', '') for item in result]
-
-def get_queries(content: str) -> list[str]:
-    return parse_project(content, 'A')
-
-def get_probabilities(content: str) -> list[str]:
-    return parse_project(content, 'Pr')
-
-def get_simulations(content: str) -> list[str]:
-    return parse_project(content, 'simulate')
-
-def generate_properties(properties: list[str], path: str, prefix: str):
-    index = 0
-    for property in properties:
-        with open(os.path.join(path, '{}_{:02d}.txt'.format(prefix, index)), 'w') as file:
-            file.write('{}\n'.format(property))
-        index += 1
-
-def generate_queries(queries: list[str], path: str):
-    generate_properties(queries, path, 'query')
-
-def generate_probabilities(probabilities: list[str], path: str):
-    generate_properties(probabilities, path, 'probability')
-
-def generate_simulations(simulations: list[str], path: str):
-    generate_properties(simulations, path, 'simulation')
+def clean_formula(formula: str) -> str:
+    return formula.replace('\n', ' ').replace('\t', '')
+
+def parse_all_formulas(content: str) -> dict[str, list[str]]:
+    formulas = {prefix: [] for prefix in FORMULA_PREFIXES}
+    for _, element in ET.iterparse(io.BytesIO(content.encode('utf-8')), events=('end',)):
+        if element.tag == 'formula' and element.text is not None:
+            for prefix in FORMULA_PREFIXES:
+                if element.text.startswith(prefix):
+                    formulas[prefix].append(clean_formula(element.text))
+                    break
+        element.clear()
+    return formulas
+
+def generate_properties(properties: list[str], path: str, prefix: str) -> tuple[str, str]:
+    content = ''.join('{}\n'.format(property) for property in properties)
+    file_name = os.path.join(path, '{}.q'.format(prefix))
+    with open(file_name, 'w') as file:
+        file.write(content)
+    return file_name, content
 
 def to_array(values: list, short: bool = False):
     if not short:
-        return '{{{}}}'.format(', '.join([str(value) for value in values]))
+        return ARRAY_FORMAT.format(', '.join(map(str, values)))
     else:
-        return '[{}]'.format(','.join([str(value) for value in values]))
+        return SHORT_ARRAY_FORMAT.format(','.join(map(str, values)))
 
 def get_space_length(min: list[int], max: list[int]) -> int:
     value = 1
@@ -129,130 +213,187 @@ def get_space_float(min: list[float], max: list[float], samples: int):
         yield result
 
 def generate_extensive_project(values: list[dict], stochastic: bool):
-    for speed in range(values['speed']['min'], values['speed']['max'] + 1):
-        for disks in range(values['disks']['min'], values['disks']['max'] + 1):
-            for policy in range(values['policy']['min'], values['policy']['max'] + 1):
-                for sensors in get_space(values['out_sensors']['min'], values['out_sensors']['max']):
-                    for stations in get_space(values['stations_processing']['min'], values['stations_processing']['max']):
-                        if not stochastic:
-                            yield {
-                                'speed': speed,
-                                'disks': disks,
-                                'policy': policy,
-                                'out_sensors': sensors,
-                                'stations_processing': stations
-                            }
-                        else:
-                            for standard_deviation in get_space_float(values['station_std_deviation']['min'], values['station_std_deviation']['max'], values['station_std_deviation_samples']):
-                                for in_sensor_err in get_space(values['in_sensor_err']['min'], values['in_sensor_err']['max']):
-                                    for in_sensor_right in get_space(values['in_sensor_right']['min'], values['in_sensor_right']['max']):
-                                        for out_sensor_err in get_space(values['out_sensor_err']['min'], values['out_sensor_err']['max']):
-                                            for out_sensor_right in get_space(values['out_sensor_right']['min'], values['out_sensor_right']['max']):
-                                                yield {
-                                                    'speed': speed,
-                                                    'disks': disks,
-                                                    'policy': policy,
-                                                    'out_sensors': sensors,
-                                                    'stations_processing': stations,
-                                                    'station_std_deviation': standard_deviation,
-                                                    'in_sensor_err': in_sensor_err,
-                                                    'in_sensor_right': in_sensor_right,
-                                                    'out_sensor_err': out_sensor_err,
-                                                    'out_sensor_right': out_sensor_right
-                                                }
-
-def generate_project(project: list[str], values: list[dict], name: str, stochastic: bool):
-    new_project = []
-    system = False
-    done = False
-    static = '''
-initializer = Initializer(DISKS);
-motor = Motor(SPEED);
-conveyorBelt = ConveyorBelt();
-station(const StationId id) = Station(id, POS_STATIONS[id], STATIONS_ELABORATION_TIME[id], POS_IN_SENSORS_IN_ORDER[id], OUT_SENSORS_ID_IN_ORDER[id]);
-inSensor(const InSensorId id) = InSensor(id, IN_SENSORS_STATION[id]);
-outSensor(const OutSensorId id) = OutSensor(id, POS_OUT_SENSORS[id]);
-'''
-    static_stochastic = '''
-initializer = Initializer(DISKS);
-motor = Motor(SPEED);
-conveyorBelt = ConveyorBelt();
-station(const StationId id) = Station(id, POS_STATIONS[id], STATIONS_ELABORATION_TIME[id], POS_IN_SENSORS_IN_ORDER[id], OUT_SENSORS_ID_IN_ORDER[id], STD_DEV_STATIONS[id]);
-inSensor(const InSensorId id) = InSensor(id, IN_SENSORS_STATION[id], IN_SENSORS_RIGHT[id], IN_SENSORS_ERR[id]);
-outSensor(const OutSensorId id) = OutSensor(id, POS_OUT_SENSORS[id], OUT_SENSORS_RIGHT[id], OUT_SENSORS_ERR[id]);
-'''
-    for line in project:
-        if not system and '<system>' not in line:
-            new_project.append('{}\n'.format(line))
-        elif '</system>' in line:
-            system = False
-        elif not done:
-            system = True
-            done = True
-            new_project.append('    <system>\n')
-            new_project.append('const int SPEED = {};\n'.format(values['speed']))
-            new_project.append('const int[1, 12] DISKS = {};\n'.format(values['disks']))
-            new_project.append('const SlotId POS_OUT_SENSORS[OUT_SENSORS] = {};\n'.format(to_array(values['out_sensors'])))
-            new_project.append('const int STATIONS_ELABORATION_TIME[STATIONS] = {};\n'.format(to_array(values['stations_processing'])))
-            if not stochastic:
-                new_project.append(static)
-            else:
-                new_project.append('const double STD_DEV_STATIONS[STATIONS] = {};\n'.format(to_array(values['station_std_deviation'])))
-                new_project.append('const int IN_SENSORS_ERR[IN_SENSORS] = {};\n'.format(to_array(values['in_sensor_err'])))
-                new_project.append('const int IN_SENSORS_RIGHT[IN_SENSORS] = {};\n'.format(to_array(values['in_sensor_right'])))
-                new_project.append('const int OUT_SENSORS_ERR[OUT_SENSORS] = {};\n'.format(to_array(values['out_sensor_err'])))
-                new_project.append('const int OUT_SENSORS_RIGHT[OUT_SENSORS] = {};\n'.format(to_array(values['out_sensor_right'])))
-                new_project.append(static_stochastic)
-            if values['policy'] == 0:
-                new_project.append('flowController = FlowController_0(POS_OUT_SENSORS[2], POS_OUT_SENSORS[3]);\n')
-            else:
-                new_project.append('flowController = FlowController_{}();\n'.format(values['policy']))
-            new_project.append('system initializer, motor, conveyorBelt, station, inSensor, outSensor, flowController;\n')
-            new_project.append('    </system>\n')
-    with open(name, 'w') as file:
-        file.writelines(new_project)
+    space = [
+        range(values['speed']['min'], values['speed']['max'] + 1),
+        range(values['disks']['min'], values['disks']['max'] + 1),
+        range(values['policy']['min'], values['policy']['max'] + 1),
+        list(get_space(values['out_sensors']['min'], values['out_sensors']['max'])),
+        list(get_space(values['stations_processing']['min'], values['stations_processing']['max']))
+    ]
+    if not stochastic:
+        for speed, disks, policy, sensors, stations in product(*space):
+            yield {
+                'speed': speed,
+                'disks': disks,
+                'policy': policy,
+                'out_sensors': sensors,
+                'stations_processing': stations
+            }
+    else:
+        space += [
+            list(get_space_float(values['station_std_deviation']['min'], values['station_std_deviation']['max'], values['station_std_deviation_samples'])),
+            list(get_space(values['in_sensor_err']['min'], values['in_sensor_err']['max'])),
+            list(get_space(values['in_sensor_right']['min'], values['in_sensor_right']['max'])),
+            list(get_space(values['out_sensor_err']['min'], values['out_sensor_err']['max'])),
+            list(get_space(values['out_sensor_right']['min'], values['out_sensor_right']['max']))
+        ]
+        for speed, disks, policy, sensors, stations, standard_deviation, in_sensor_err, in_sensor_right, out_sensor_err, out_sensor_right in product(*space):
+            yield {
+                'speed': speed,
+                'disks': disks,
+                'policy': policy,
+                'out_sensors': sensors,
+                'stations_processing': stations,
+                'station_std_deviation': standard_deviation,
+                'in_sensor_err': in_sensor_err,
+                'in_sensor_right': in_sensor_right,
+                'out_sensor_err': out_sensor_err,
+                'out_sensor_right': out_sensor_right
+            }
+
+def build_system_block(values: list[dict], stochastic: bool) -> str:
+    if values['policy'] == 0:
+        flow_controller = 'FlowController_0(POS_OUT_SENSORS[2], POS_OUT_SENSORS[3])'
+    else:
+        flow_controller = 'FlowController_{}()'.format(values['policy'])
+    if not stochastic:
+        return SYSTEM_TEMPLATE.format(
+            speed=values['speed'],
+            disks=values['disks'],
+            out_sensors=to_array(values['out_sensors']),
+            stations_processing=to_array(values['stations_processing']),
+            flow_controller=flow_controller)
+    else:
+        return STOCHASTIC_SYSTEM_TEMPLATE.format(
+            speed=values['speed'],
+            disks=values['disks'],
+            out_sensors=to_array(values['out_sensors']),
+            stations_processing=to_array(values['stations_processing']),
+            station_std_deviation=to_array(values['station_std_deviation']),
+            in_sensor_err=to_array(values['in_sensor_err']),
+            in_sensor_right=to_array(values['in_sensor_right']),
+            out_sensor_err=to_array(values['out_sensor_err']),
+            out_sensor_right=to_array(values['out_sensor_right']),
+            flow_controller=flow_controller)
+
+def generate_project(template: tuple[str, str], values: list[dict], stochastic: bool) -> str:
+    prefix, suffix = template
+    return prefix + build_system_block(values, stochastic) + suffix
 
 def generate_projects(config: dict, scenario: str, stochastic: bool):
     if scenario == 'extensive':
         return generate_extensive_project(config[scenario], stochastic), get_extensive_length(config[scenario], stochastic)
     elif scenario in config:
-        return [config[scenario]], 1
+        return [{key: value for key, value in config[scenario].items() if key not in CONTROL_KEYS}], 1
     else:
         print('Configuration not found')
         return None, 0
 
-def output_folder_parser(path: str, prefix: str) -> list[list[str]]:
-    items = []
-    for item in os.listdir(path):
-        if item.startswith(prefix):
-            items.append(os.path.join(path, item))
-    return items
-
-def output_folder_queries(path: str) -> list[list[str]]:
-    return output_folder_parser(path, 'query')
-
-def output_folder_probabilities(path: str) -> list[list[str]]:
-    return output_folder_parser(path, 'probability')
-
-def output_folder_simulations(path: str) -> list[list[str]]:
-    return output_folder_parser(path, 'simulation')
-
-def gen_args(content: list[str], verifier: str, projects: list, properties: list[str], path: str, stochastic: bool):
-    for project in projects:
-        for property in properties:
-            yield content, verifier, project, property, path, stochastic
-
-def gen_name(values: dict, property: str, stochastic: str):
+def get_monotone_rules(config: dict, scenario: str, properties: list[str]) -> list[dict]:
+    rules = config[scenario].get('monotone', {}) if scenario in config else {}
+    for query, rule in rules.items():
+        for parameter, direction in rule.items():
+            if direction not in MONOTONE_DIRECTIONS:
+                print(f'[ERROR] Invalid monotone direction "{direction}" for parameter "{parameter}" of query {query}')
+                print('[ERROR] Please use "increasing" or "decreasing"')
+                exit(1)
+    return [rules.get('{:02d}'.format(index)) for index in range(len(properties))]
+
+def get_stop_flags(config: dict, scenario: str, phase: str, properties: list[str]) -> list[bool]:
+    flagged = config[scenario].get('stop_on_first_sat', {}).get(phase, []) if scenario in config else []
+    return ['{:02d}'.format(index) in flagged for index in range(len(properties))]
+
+def as_tuple(value) -> tuple:
+    return tuple(value) if isinstance(value, (list, tuple)) else (value,)
+
+def implies(rule: dict, source: dict, target: dict, satisfied: bool) -> bool:
+    for parameter in source:
+        if parameter not in rule:
+            if as_tuple(source[parameter]) != as_tuple(target[parameter]):
+                return False
+        else:
+            if (rule[parameter] == 'increasing') == satisfied:
+                lower, upper = source[parameter], target[parameter]
+            else:
+                lower, upper = target[parameter], source[parameter]
+            if any(low > up for low, up in zip(as_tuple(lower), as_tuple(upper))):
+                return False
+    return True
+
+def get_box_key(rule: dict, values: dict) -> tuple:
+    return tuple(as_tuple(values[parameter]) for parameter in sorted(values) if parameter not in rule)
+
+def add_box(rule: dict, boxes: dict, values: dict, satisfied: bool):
+    frontier = boxes.setdefault((satisfied, get_box_key(rule, values)), [])
+    if any(implies(rule, box, values, satisfied) for box in frontier):
+        return
+    frontier[:] = [box for box in frontier if not implies(rule, values, box, satisfied)]
+    frontier.append(values)
+
+def infer_outcomes(rules: list[dict], known: list[dict], project: dict) -> list:
+    outcomes = []
+    for rule, boxes in zip(rules, known):
+        key = get_box_key(rule, project)
+        outcome = None
+        for satisfied in (True, False):
+            for box in boxes.get((satisfied, key), []):
+                if implies(rule, box, project, satisfied):
+                    outcome = satisfied
+                    break
+            if outcome is not None:
+                break
+        outcomes.append(outcome)
+    return outcomes
+
+def get_processes(length: int) -> int:
+    return max(1, min(os.cpu_count() - 1, length))
+
+def map_tasks(pool: Pool, function, tasks, chunksize: int = 1):
+    if pool is None:
+        return map(function, tasks)
+    return pool.imap_unordered(function, tasks, chunksize=chunksize)
+
+def init_worker(template: tuple[str, str], verifier: str, path: str, stochastic: bool, cache: str, timeout: int, stopped: Event):
+    status = os.stat(verifier)
+    worker.update(template=template, verifier=verifier, command=[verifier, '-w', '1'], stamp='{}:{}'.format(status.st_size, status.st_mtime_ns), path=path, stochastic=stochastic, cache=cache, timeout=timeout, stopped=stopped)
+    signal.signal(signal.SIGTERM, handle_sigint)
+
+def kill_process(process: subprocess.Popen):
+    if worker['timeout'] is not None and hasattr(os, 'killpg'):
+        with suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGKILL)
+    else:
+        process.kill()
+
+def read_cache(key: str) -> tuple[str, float]:
+    if worker['cache'] is None or key is None:
+        return None
+    file_name = os.path.join(worker['cache'], key)
+    if not os.path.isfile(file_name):
+        return None
+    with open(file_name, 'rb') as file:
+        elapsed, _, output = file.read().decode().partition('\n')
+    return output, float(elapsed)
+
+def write_cache(key: str, output: str, elapsed: float):
+    if worker['cache'] is None or key is None:
+        return
+    file_name = os.path.join(worker['cache'], key)
+    partial_name = '{}.{}'.format(file_name, os.getpid())
+    with open(partial_name, 'wb') as file:
+        file.write('{}\n{}'.format(elapsed, output).encode())
+    os.replace(partial_name, file_name)
+
+def gen_name(values: dict, stochastic: str):
     if not stochastic:
-        return 's{}-d{}-p{}-os{}-sp{}-{}'.format(
+        return 's{}-d{}-p{}-os{}-sp{}'.format(
             values['speed'],
             values['disks'],
             values['policy'],
             to_array(values['out_sensors'], short=True),
-            to_array(values['stations_processing'], short=True),
-            property[-6:-4])
+            to_array(values['stations_processing'], short=True))
     else:
-        return 's{}-d{}-p{}-os{}-sp{}-std{}-ie{}-ir{}-oe{}-or{}-{}'.format(
+        return 's{}-d{}-p{}-os{}-sp{}-std{}-ie{}-ir{}-oe{}-or{}'.format(
             values['speed'],
             values['disks'],
             values['policy'],
@@ -262,85 +403,157 @@ def gen_name(values: dict, property: str, stochastic: str):
             to_array(values['in_sensor_err'], short=True),
             to_array(values['in_sensor_right'], short=True),
             to_array(values['out_sensor_err'], short=True),
-            to_array(values['out_sensor_right'], short=True),
-            property[-6:-4])
+            to_array(values['out_sensor_right'], short=True))
 
-def run_property(parameters: list[tuple[list[str], str, dict, str, str, bool]]) -> bool:
-    start = time()
-    content, verifier, project, property, path, stochastic = parameters
-    name = gen_name(project, property, stochastic)
-    fullname = os.path.join(path, 'project_{}.xml'.format(name))
-    generate_project(content, project, fullname, stochastic)
-    result = subprocess.run([verifier, '-w', '1', fullname, property], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    os.remove(fullname)
-    if result.returncode != 0:
-        print('[ERROR]', result.stderr.decode().rstrip())
-        exit(1)
-    return result.stdout.decode(), name, property.split('/')[-1], time() - start
+def split_results(output: str) -> list[str]:
+    return ['Verifying formula{}'.format(result) for result in output.split('Verifying formula')[1:]]
 
-def run_all(content: list[str], verifier: str, projects: list, properties: list[str], path: str, prefix: str, description: str, length: int, stochastic: bool) -> dict:
-    pool = Pool(os.cpu_count() - 1)
+def run_property(properties: str, properties_content: str, cached: bool, project: dict) -> tuple[list[str], str, float]:
+    start = time()
+    name = gen_name(project, worker['stochastic'])
+    if worker['stopped'].is_set():
+        return [], name, 0.0
+    content = generate_project(worker['template'], project, worker['stochastic'])
+    key = hashlib.blake2b('\0'.join(worker['command'] + [worker['stamp'], content, properties_content]).encode()).hexdigest() if cached else None
+    hit = read_cache(key)
+    if hit is not None:
+        output, elapsed = hit
+    else:
+        fullname = os.path.join(worker['path'], 'project_{}.xml'.format(name))
+        with open(fullname, 'w') as file:
+            file.write(content)
+        process = subprocess.Popen(worker['command'] + [fullname, properties], stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=False, start_new_session=worker['timeout'] is not None)
+        try:
+            stdout, stderr = process.communicate(timeout=worker['timeout'])
+        except subprocess.TimeoutExpired:
+            kill_process(process)
+            process.communicate()
+            return [TIMEOUT_RESULT] * properties_content.count('\n'), name, time() - start
+        except BaseException:
+            kill_process(process)
+            raise
+        finally:
+            os.remove(fullname)
+        if process.returncode != 0:
+            print('[ERROR]', stderr.decode().rstrip())
+            exit(1)
+        output = stdout.decode()
+        elapsed = time() - start
+        write_cache(key, output, elapsed)
+    return split_results(output), name, elapsed
+
+def run_all(pool: Pool, stopped: Event, projects: list, properties: list[str], path: str, prefix: str, description: str, length: int, stochastic: bool, cached: bool, rules: list[dict], stop: list[bool]) -> dict:
+    processes = get_processes(length)
+    chunksize = 1 if any(stop) else max(1, min(MAX_CHUNKSIZE, length // (processes + 2)))
+    miniters = max(1, length // 100)
+    run = partial(run_property, *generate_properties(properties, path, prefix), cached)
     results = {}
     print('\033[;1m')
-    for result, project, property, time in tqdm(pool.imap_unordered(run_property, gen_args(content, verifier, projects, properties, path, stochastic)), desc=description, total=length * len(properties)):
-        property = property.split('{}_'.format(prefix))[1].strip('.txt')
-        results[(project[:-3], property)] = (result, '{0:.2f} seconds'.format(time))
-    pool.close()
-    pool.join()
+    if len(rules) == 0 or None in rules:
+        unwitnessed = set(range(len(stop)))
+        skipped = 0
+        for outputs, project, time in tqdm(map_tasks(pool, run, projects, chunksize), desc=description, total=length, mininterval=0.5, miniters=miniters):
+            if len(outputs) == 0:
+                skipped += 1
+            for index, result in enumerate(outputs):
+                results[(project, '{:02d}'.format(index))] = (result, '{0:.2f} seconds'.format(time))
+                if 'Formula is satisfied' in result:
+                    unwitnessed.discard(index)
+            if len(stop) > 0 and all(stop) and len(unwitnessed) == 0:
+                stopped.set()
+        if stopped.is_set():
+            print('Stopped early, every formula has been satisfied: {} configurations were skipped'.format(skipped))
+        stopped.clear()
+    else:
+        known = [{} for _ in rules]
+        progress = tqdm(desc=description, total=length, mininterval=0.5, miniters=miniters)
+        completed = Queue()
+        pending = {}
+        projects = iter(projects)
+        while True:
+            while len(pending) < processes * 2 and (project := next(projects, None)) is not None:
+                name = gen_name(project, stochastic)
+                outcomes = infer_outcomes(rules, known, project)
+                if None in outcomes:
+                    pending[name] = project
+                    if pool is None:
+                        completed.put(run(project))
+                    else:
+                        pool.apply_async(run, (project,), callback=completed.put, error_callback=completed.put)
+                    continue
+                for index, satisfied in enumerate(outcomes):
+                    results[(name, '{:02d}'.format(index))] = (INFERRED_RESULTS[satisfied], 'inferred')
+                progress.update()
+            if len(pending) == 0:
+                break
+            completion = completed.get()
+            if isinstance(completion, BaseException):
+                raise completion
+            outputs, name, time = completion
+            for index, result in enumerate(outputs):
+                results[(name, '{:02d}'.format(index))] = (result, '{0:.2f} seconds'.format(time))
+                if 'Formula is satisfied' in result or 'Formula is NOT satisfied' in result:
+                    add_box(rules[index], known[index], pending[name], 'Formula is satisfied' in result)
+            del pending[name]
+            progress.update()
+        progress.close()
     print('\033[0m')
     return results
 
-def run_all_queries(content: list[str], verifier: str, projects: list, queries: list[str], path: str, length: str, stochastic: bool) -> dict:
-    return run_all(content, verifier, projects, queries, path, 'query', 'Verifying queries', length, stochastic)
+def run_all_queries(pool: Pool, stopped: Event, projects: list, queries: list[str], path: str, length: str, stochastic: bool, rules: list[dict]) -> dict:
+    return run_all(pool, stopped, projects, queries, path, 'query', 'Verifying queries', length, stochastic, True, rules, [])
+
+def run_all_probabilities(pool: Pool, stopped: Event, projects: list, probabilities: list[str], path: str, length: str, stochastic: bool, stop: list[bool]) -> dict:
+    return run_all(pool, stopped, projects, probabilities, path, 'probability', 'Calculating probabilities', length, stochastic, False, [], stop)
 
-def run_all_probabilities(content: list[str], verifier: str, projects: list, probabilities: list[str], path: str, length: str, stochastic: bool) -> dict:
-    return run_all(content, verifier, projects, probabilities, path, 'probability', 'Calculating probabilities', length, stochastic)
+def run_all_simulations(pool: Pool, stopped: Event, projects: list, simulations: list[str], path: str, length: str, stochastic: bool, stop: list[bool]) -> dict:
+    return run_all(pool, stopped, projects, simulations, path, 'simulation', 'Simulating', length, stochastic, False, [], stop)
 
-def run_all_simulations(content: list[str], verifier: str, projects: list, simulations: list[str], path: str, length: str, stochastic: bool) -> dict:
-    return run_all(content, verifier, projects, simulations, path, 'simulation', 'Simulating', length, stochastic)
+def get_outcome(result: str) -> bool:
+    if result == TIMEOUT_RESULT:
+        return None
+    return 'Formula is satisfied' in result
+
+def print_timeouts(results: dict) -> bool:
+    timeouts = {project for (project, _), (result, _) in results.items() if result == TIMEOUT_RESULT}
+    if len(timeouts) > 0:
+        print('\033[33;1m{} models timed out, their outcome is unknown!\033[0m\n'.format(len(timeouts)))
+    return len(timeouts) > 0
 
 def print_queries(results: dict, queries: str, verbose: bool):
     projects = {}
     failed = False
-    for project, query in results:
-        if project not in projects:
-            projects[project] = {}
-        result, time = results[(project, query)]
-        projects[project][query] = {'query': queries[int(query)], 'result': 'Formula is satisfied' in result, 'time': time}
+    for (project, query), (result, time) in results.items():
+        projects.setdefault(project, {})
+        projects[project][query] = {'query': queries[int(query)], 'result': get_outcome(result), 'time': time}
         if not result:
             failed = True
-    for project in projects:
-        projects[project] = dict(sorted(projects[project].items()))
-    projects = dict(sorted(projects.items()))
+    timed_out = print_timeouts(results)
     if failed:
         print('\033[31;1mSome properties aren\'t satisfied!\033[0m\n')
-    else:
+    elif not timed_out:
         print('\033[32;1mAll the properties are satisfied!\033[0m\n')
     if verbose:
         print('\033[;1mVerification results\033[0m:')
-        print(json.dumps(projects))
+        print(dumps(projects))
         print()
 
 def print_probabilities(results: dict, probabilities: str, verbose: bool):
     projects = {}
-    interval_regex = re.compile(r'\[([\d.e-]+),([\d.e-]+)\]\s+\(([\d]+)\% CI\)')
-    values_regex = re.compile(r'Values in \[(\d+),(\d+)\] mean=([\d.e-]+) steps=1: (.+)')
-    for project, probability in results:
-        if project not in projects:
-            projects[project] = {}
-        result, time = results[(project, probability)]
+    for (project, probability), (result, time) in results.items():
+        projects.setdefault(project, {})
         if 'Formula is satisfied' in result:
             full_match = True
-            matches = interval_regex.findall(result.split('\r\n')[-3])
-            if len(matches) == 0:
+            lines = result.rsplit('\r\n', 3)
+            match = INTERVAL_REGEX.search(lines[-3])
+            if match is None:
                 full_match = False
-                matches = interval_regex.findall(result.split('\r\n')[-2])[0]
-            else:
-                matches = matches[0]
+                match = INTERVAL_REGEX.search(lines[-2])
+            matches = match.groups()
             confidence = float(matches[2]) / 100
             interval = {'min': float(matches[0]), 'max': float(matches[1])}
             if full_match:
-                matches = values_regex.findall(result.split('\r\n')[-2])[0]
+                matches = VALUES_REGEX.search(lines[-2]).groups()
                 values_range = {'min': int(matches[0]), 'max': int(matches[1])}
                 mean = float(matches[2])
                 values = [int(match) for match in matches[3].split(' ')]
@@ -354,60 +567,44 @@ def print_probabilities(results: dict, probabilities: str, verbose: bool):
             values_range = {'min': 0, 'max': 0}
             mean = 0.0
             values = []
-        projects[project][probability] = {'probability': probabilities[int(probability)], 'result': {'outcome': 'Formula is satisfied' in result, 'interval': interval, 'confidence': confidence, 'values': {'range': values_range, 'mean': mean, 'samples': values}}, 'time': time}
-    for project in projects:
-        projects[project] = dict(sorted(projects[project].items()))
-    projects = dict(sorted(projects.items()))
+        projects[project][probability] = {'probability': probabilities[int(probability)], 'result': {'outcome': get_outcome(result), 'interval': interval, 'confidence': confidence, 'values': {'range': values_range, 'mean': mean, 'samples': values}}, 'time': time}
+    print_timeouts(results)
     if verbose:
         print('\033[;1mProbabilities\033[0m:')
-        print(json.dumps(projects))
+        print(dumps(projects))
         print()
 
 def process_values(result: str, index: int, path: str) -> tuple[str, int]:
-    get_values = re.compile(r'\(([\d.]+),(\d+)\)')
-    results = result.split('Verifying formula')[1].split('\r\n')[2:-1]
-    result = {}
-    while len(results) > 0:
+    result_series = {}
+    for match in SERIES_LINE_REGEX.finditer(result, result.find('Verifying formula')):
         index += 1
-        formula = results[0]
-        values = [[int(value[0].split('.')[0]), int(value[1])] for value in get_values.findall(results[1])]
-        results = results[2:]
+        points = SERIES_REGEX.finditer(result, match.start(2), match.end(2))
+        values = numpy.fromiter(((int(point.group(1).partition('.')[0]), int(point.group(2))) for point in points), dtype=(numpy.int64, 2))
         file_name = '{}_{:02d}.csv'.format('values', index)
-        with open(os.path.join(path, file_name), 'w') as file:
-            writer = csv.writer(file, delimiter=',', lineterminator='\n')
-            writer.writerow(['x', 'y'])
-            writer.writerows(values)
-            file.close()
-        result[formula] = file_name
-    return result, index
+        numpy.savetxt(os.path.join(path, file_name), values, fmt='%d', delimiter=',', header='x,y', comments='')
+        result_series[match.group(1)] = file_name
+    return result_series, index
 
 def print_simulations(results: dict, simulations: str, path: str, verbose: bool):
     projects = {}
     index = 0
-    for project, simulation in results:
-        if project not in projects:
-            projects[project] = {}
-        result, time = results[(project, simulation)]
+    for (project, simulation), (result, time) in sorted(results.items()):
+        projects.setdefault(project, {})
         values, index = process_values(result, index, path)
-        projects[project][simulation] = {'simulation': simulations[int(simulation)], 'result': 'Formula is satisfied' in result, 'series': values, 'time': time}
-    for project in projects:
-        projects[project] = dict(sorted(projects[project].items()))
-    projects = dict(sorted(projects.items()))
+        projects[project][simulation] = {'simulation': simulations[int(simulation)], 'result': get_outcome(result), 'series': values, 'time': time}
+    print_timeouts(results)
     if verbose:
         print('\033[;1mSimulations\033[0m:')
-        print(json.dumps(projects))
+        print(dumps(projects))
         print()
 
 if __name__ == '__main__':
 
-    output_directory = 'tmp'
+    output_directory = get_output_directory()
     result_directory = 'results'
 
     signal.signal(signal.SIGINT, handle_sigint)
-
-    if os.path.isdir(output_directory):
-        shutil.rmtree(output_directory)
-    os.makedirs(output_directory)
+    atexit.register(shutil.rmtree, output_directory, ignore_errors=True)
 
     if os.path.isdir(result_directory):
         shutil.rmtree(result_directory)
@@ -430,30 +627,43 @@ if __name__ == '__main__':
         print('[ERROR] Please provide a valid path')
         exit(1)
 
-    project, stochastic = get_project(args.project_fname)
+    content, stochastic = get_project(args.project_fname)
     config = get_config(args.config_fname)
-    full_project = '\n'.join(project)
+    template = split_project(content)
 
-    queries = get_queries(full_project)
-    probabilities = get_probabilities(full_project)
-    simulations = get_simulations(full_project)
+    formulas = parse_all_formulas(content)
+    queries = formulas['A']
+    probabilities = formulas['Pr']
+    simulations = formulas['simulate']
 
-    generate_queries(queries, output_directory)
-    generate_probabilities(probabilities, output_directory)
-    generate_simulations(simulations, output_directory)
     projects, length = generate_projects(config, args.scenario, stochastic)
+    rules = get_monotone_rules(config, args.scenario, queries)
+
+    cache = None
+    if not args.no_cache:
+        cache = CACHE_DIRECTORY
+        os.makedirs(cache, exist_ok=True)
 
     if projects is not None:
-        if not args.no_queries and len(queries) > 0:
-            projects, length = generate_projects(config, args.scenario, stochastic)
-            print_queries(run_all_queries(project, args.verifyta, projects, output_folder_queries(output_directory), output_directory, length, stochastic), queries, not args.short)
-        if not args.no_probabilities and len(probabilities) > 0:
-            projects, length = generate_projects(config, args.scenario, stochastic)
-            print_probabilities(run_all_probabilities(project, args.verifyta, projects, output_folder_probabilities(output_directory), output_directory, length, stochastic), probabilities, not args.short)
-        if not args.no_simulations and len(simulations) > 0:
-            projects, length = generate_projects(config, args.scenario, stochastic)
-            print_simulations(run_all_simulations(project, args.verifyta, projects, output_folder_simulations(output_directory), output_directory, length, stochastic), simulations, result_directory, not args.short)
-
-    shutil.rmtree(output_directory)
-    if len(os.listdir(result_directory)) == 0:
+        stopped = CONTEXT.Event()
+        initargs = (template, args.verifyta, output_directory, stochastic, cache, args.task_timeout, stopped)
+        with CONTEXT.Pool(get_processes(length), initializer=init_worker, initargs=initargs) if get_processes(length) > 1 else nullcontext() as pool:
+            if pool is None:
+                init_worker(*initargs)
+            if not args.no_queries and len(queries) > 0:
+                projects, length = generate_projects(config, args.scenario, stochastic)
+                print_queries(run_all_queries(pool, stopped, projects, queries, output_directory, length, stochastic, rules), queries, not args.short)
+            if not args.no_probabilities and len(probabilities) > 0:
+                projects, length = generate_projects(config, args.scenario, stochastic)
+                print_probabilities(run_all_probabilities(pool, stopped, projects, probabilities, output_directory, length, stochastic, get_stop_flags(config, args.scenario, 'probabilities', probabilities)), probabilities, not args.short)
+            if not args.no_simulations and len(simulations) > 0:
+                projects, length = generate_projects(config, args.scenario, stochastic)
+                print_simulations(run_all_simulations(pool, stopped, projects, simulations, output_directory, length, stochastic, get_stop_flags(config, args.scenario, 'simulations', simulations)), simulations, result_directory, not args.short)
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    with os.scandir(result_directory) as entries:
+        empty = next(entries, None) is None
+    if empty:
         shutil.rmtree(result_directory)